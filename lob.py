@@ -1,6 +1,18 @@
+import numpy as np
 import pandas as pd
 import streamlit as st
+import datetime
 import io
+import math
+import re
+import zipfile
+from xml.sax.saxutils import escape
+
+try:
+    from numba import njit
+except ImportError:  # numba is optional; the placement kernel then runs as plain Python
+    def njit(*args, **kwargs):
+        return lambda func: func
 
 # ---------- Page & Sidebar ----------
 st.set_page_config(page_title="LOB Filler", layout="wide")
@@ -37,28 +49,214 @@ def _std_str_series(s):
     """Strip & cast to string safely."""
     return s.astype(str).str.strip()
 
-def _cell_is_empty(val) -> bool:
-    """Only NaN/None/'' count as empty. 'Stock' is NOT empty (preserve it)."""
-    if val is None:
-        return True
-    if isinstance(val, float) and pd.isna(val):
-        return True
-    if isinstance(val, str):
-        return val.strip() == ""
-    return False
+def _dates_as_text(df):
+    """Turn date cells into their str() text (NaT -> NA), as the export wrote them before it streamed rows.
+
+    Run on the frame as parsed: datetime64 columns are converted whole, object columns cell by cell.
+    """
+    for j in range(df.shape[1]):
+        col = df.iloc[:, j]
+        if pd.api.types.is_datetime64_any_dtype(col):
+            df.isetitem(j, col.map(str).where(col.notna()))
+        elif col.dtype == object and pd.api.types.infer_dtype(col, skipna=True) != "string":
+            # mixed Excel columns can hold datetime objects next to text
+            df.isetitem(j, col.map(
+                lambda v: str(v) if isinstance(v, (datetime.date, datetime.time)) and v is not pd.NaT else v
+            ))
+    return df
+
+def _nonfinite_as_text(val):
+    """inf/-inf/NaN as the text pandas' to_excel wrote for them (inf_rep="inf", na_rep=""); xlsxwriter can't store them as numbers."""
+    if isinstance(val, (float, np.floating)) and not math.isfinite(val):
+        return "" if math.isnan(val) else "inf" if val > 0 else "-inf"
+    return val
+
+def _write_text(worksheet, row, col, token, cell_format=None):
+    """xlsxwriter write() handler for str: a text cell (blank if empty), never a formula or URL."""
+    if token == "":
+        return worksheet.write_blank(row, col, None, cell_format)
+    return worksheet.write_string(row, col, token, cell_format)
+
+def _html_table(df) -> str:
+    """Render a frame of prebuilt cell HTML as a <table> (unescaped, like to_html(escape=False))."""
+    head = "".join(f"<th>{c}</th>" for c in df.columns)
+    body = "".join(
+        f"<tr><th>{stock}</th>" + "".join(f"<td>{v}</td>" for v in row) + "</tr>"
+        for stock, *row in df.itertuples(index=True, name=None)
+    )
+    return (
+        '<table border="1" class="dataframe">'
+        f'<thead><tr style="text-align: right;"><th>{df.index.name or ""}</th>{head}</tr></thead>'
+        f"<tbody>{body}</tbody></table>"
+    )
+
+# Exports with at least this many LOB rows skip xlsxwriter's cell API and get their sheet XML written directly
+_DIRECT_XML_MIN_ROWS = 1000
+
+# Same escaping xlsxwriter applies to strings: control characters become _xHHHH_, literal _xHHHH_ gets _x005F
+_XLSX_LITERAL_ESCAPE = re.compile(r"(_x[0-9a-fA-F]{4}_)")
+_XLSX_CONTROL_CHARS = re.compile(r"[\x00-\x08\x0b-\x1f]")
+
+def _xlsx_cell_xml(val, xf_index=0) -> str:
+    """One <c> element for a dense row: no r= reference, and the default style s=0 is left out.
+
+    Values are encoded the way the streamed export's write() stores them, so both export paths agree;
+    strings are always text (see _write_text), so a LOB cell like "=1+2" is not exported as a formula.
+    """
+    style = f' s="{xf_index}"' if xf_index else ""
+    if val is None or val is pd.NaT or val is pd.NA:
+        return f"<c{style}/>"
+    if isinstance(val, (bool, np.bool_)):
+        return f'<c{style} t="b"><v>{int(val)}</v></c>'
+    if isinstance(val, (datetime.date, datetime.time)):
+        # Excel serial day number (General format, as write() stores a datetime without a date format)
+        if isinstance(val, datetime.time):
+            val = datetime.datetime.combine(datetime.date(1899, 12, 31), val)
+        val = (pd.Timestamp(val) - pd.Timestamp("1899-12-31")) / pd.Timedelta(days=1)
+        if val > 59:  # Excel's phantom 1900-02-29
+            val += 1
+    val = _nonfinite_as_text(val)
+    if isinstance(val, (int, float, np.integer, np.floating)):
+        return f"<c{style}><v>{val:.16G}</v></c>"
+    text = str(val)
+    if text == "":
+        return f"<c{style}/>"
+    text = _XLSX_LITERAL_ESCAPE.sub(r"_x005F\1", text)
+    text = _XLSX_CONTROL_CHARS.sub(lambda m: f"_x{ord(m.group()):04X}_", text)
+    text = text.replace("\ufffe", "_xFFFE_").replace("\uffff", "_xFFFF_")
+    space = ' xml:space="preserve"' if text != text.strip() else ""
+    return f'<c{style} t="inlineStr"><is><t{space}>{escape(text)}</t></is></c>'
+
+def _write_xlsx_direct(output, plain_table, plain_values, sup_values):
+    """Write the ETA sheet XML by hand; xlsxwriter only builds the package and registers the color styles."""
+    import xlsxwriter
+    from xlsxwriter.utility import xl_rowcol_to_cell
+
+    package = io.BytesIO()
+    workbook = xlsxwriter.Workbook(package, {"in_memory": True})
+    worksheet = workbook.add_worksheet("ETA")
+    fmt_cache = {sup: workbook.add_format({"bg_color": color}) for sup, color in supplier_colors.items()}
+    # Placeholder cells get each Format an xf index in styles.xml; the sheet they sit in is replaced below
+    for c_idx, fmt in enumerate(fmt_cache.values()):
+        worksheet.write_blank(0, c_idx, None, fmt)
+    workbook.close()
+    xf_of = {sup: fmt.xf_index for sup, fmt in fmt_cache.items()}
+
+    n_rows, n_cols = plain_values.shape
+    head = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        f'<dimension ref="A1:{xl_rowcol_to_cell(n_rows, n_cols)}"/>'
+        '<sheetViews><sheetView tabSelected="1" workbookViewId="0"/></sheetViews>'
+        '<sheetFormatPr defaultRowHeight="15"/><sheetData>'
+    )
+    tail = (
+        '</sheetData><pageMargins left="0.7" right="0.7" top="0.75" bottom="0.75" header="0.3" footer="0.3"/>'
+        "</worksheet>"
+    )
+
+    with zipfile.ZipFile(package) as src, zipfile.ZipFile(output, "w", zipfile.ZIP_DEFLATED) as dst:
+        for item in src.infolist():
+            if item.filename != "xl/worksheets/sheet1.xml":
+                dst.writestr(item, src.read(item))
+                continue
+            with dst.open(item, "w") as sheet:
+                sheet.write(head.encode())
+                header = [plain_table.index.name, *plain_table.columns]
+                sheet.write(("<row>" + "".join(_xlsx_cell_xml(c) for c in header) + "</row>").encode())
+                for stock, texts, sups in zip(plain_table.index, plain_values, sup_values):
+                    cells = "".join(_xlsx_cell_xml(t, xf_of.get(sup, 0)) for t, sup in zip(texts, sups))
+                    sheet.write(f"<row>{_xlsx_cell_xml(stock)}{cells}</row>".encode())
+                sheet.write(tail.encode())
+
+@njit(cache=True)
+def _place_shipsets(empty_cols, row_start, row_ids, qty_arr, qpss_arr):
+    """Walk ETA lines in order, putting each full shipset in the next free A/C# cell of its LOB row.
+
+    Free cells are given row-major as ``empty_cols`` with each LOB row's slice starting at
+    ``row_start[i]``, so handing out a slot is a pointer bump, never a rescan.
+    Returns the (row, col, ETA line) of every placed cell and the leftover pieces per LOB row.
+    """
+    n_rows = row_start.shape[0] - 1
+    next_slot = row_start[:-1].copy()
+    max_cells = empty_cols.shape[0]
+    place_row = np.empty(max_cells, dtype=np.int64)
+    place_col = np.empty(max_cells, dtype=np.int64)
+    place_src = np.empty(max_cells, dtype=np.int64)
+    leftovers = np.zeros(n_rows, dtype=np.int64)
+    n = 0
+    for k in range(row_ids.shape[0]):
+        qty = qty_arr[k]
+        if qty <= 0:
+            continue
+        i = row_ids[k]
+
+        # How many shipsets does this shipment cover?
+        # (rem = remainder pieces, not enough for a full shipset)
+        sets = qty // qpss_arr[k]
+        rem = qty % qpss_arr[k]
+
+        # Place 'sets' cells across the next empty A/C# columns (or as many as are left)
+        take = min(sets, row_start[i + 1] - next_slot[i])
+        for t in range(take):
+            place_row[n] = i
+            place_col[n] = empty_cols[next_slot[i] + t]
+            place_src[n] = k
+            n += 1
+        next_slot[i] += take
+
+        leftovers[i] += rem
+    return place_row[:n], place_col[:n], place_src[:n], leftovers
+
+# Keep only a few recent uploads/mappings per server process; each entry holds a full DataFrame
+@st.cache_data(show_spinner=False, max_entries=4)
+def _read_upload(data: bytes, name: str, index_col=None, excel_engine=None):
+    """Parse an uploaded CSV/XLSX; cached on the file bytes so widget reruns don't re-parse it."""
+    buf = io.BytesIO(data)
+    # CSV stays on the C engine: pyarrow rejects short/comment rows and keeps duplicate headers unrenamed
+    if name.endswith(".csv"):
+        return pd.read_csv(buf, index_col=index_col)
+    if excel_engine is not None:
+        try:
+            return pd.read_excel(buf, index_col=index_col, engine=excel_engine)
+        except (ImportError, ValueError):  # not installed, or unknown to this pandas (calamine needs >= 2.2)
+            buf.seek(0)
+    return pd.read_excel(buf, index_col=index_col)
+
+def _load_eta(data: bytes, name: str):
+    # calamine parses faster but not identically to openpyxl: whitespace-only text can come back as NaN and
+    # ints in mixed-type columns as floats (a numeric stockcode 5 among text ones reads as "5.0").
+    # Only the ETA uses it; the LOB keeps the default engine since its cells are shown and exported as uploaded.
+    df = _read_upload(data, name, excel_engine="calamine")
+    # Clean columns
+    df.columns = df.columns.str.strip()
+    return df
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def _prepare_eta(data: bytes, name: str, stock_col, supplier_col, qty_col, eta_col, qty_per_ss_col):
+    """Standardize & convert the mapped ETA columns; cached on (file bytes, column mapping)."""
+    df = _load_eta(data, name)
+    df[stock_col] = _std_str_series(df[stock_col])
+    df[supplier_col] = _std_str_series(df[supplier_col])
+
+    # numeric conversions (validated by the caller)
+    df[qty_col] = pd.to_numeric(df[qty_col], errors="coerce").fillna(0).astype(int)
+    df[qty_per_ss_col] = pd.to_numeric(df[qty_per_ss_col], errors="coerce")
+
+    # parse dates
+    df[eta_col] = pd.to_datetime(df[eta_col], errors="coerce")
+    # Cell date text MM/DD/YY, formatted once for the whole column
+    df["_eta_str"] = df[eta_col].dt.strftime("%m/%d/%y").fillna("N/A")
+    return df
 
 # ---------- Step 1: Upload ETA ----------
 uploaded_eta = st.file_uploader("Upload supplier ETA file (CSV or Excel)", type=["csv", "xlsx"])
 
 if uploaded_eta is not None:
     # Read ETA
-    if uploaded_eta.name.endswith(".csv"):
-        df_eta = pd.read_csv(uploaded_eta)
-    else:
-        df_eta = pd.read_excel(uploaded_eta)
-
-    # Clean columns
-    df_eta.columns = df_eta.columns.str.strip()
+    eta_bytes = uploaded_eta.getvalue()
+    df_eta = _load_eta(eta_bytes, uploaded_eta.name)
     st.subheader("Uploaded ETA Data")
     st.dataframe(df_eta, use_container_width=True)
 
@@ -71,12 +269,9 @@ if uploaded_eta is not None:
     qty_per_ss_col = st.selectbox("Qty/SS (pcs per shipset) column", df_eta.columns)
 
     # Standardize & convert
-    df_eta[stock_col] = _std_str_series(df_eta[stock_col])
-    df_eta[supplier_col] = _std_str_series(df_eta[supplier_col])
-
-    # numeric conversions / validation
-    df_eta[qty_col] = pd.to_numeric(df_eta[qty_col], errors="coerce").fillna(0).astype(int)
-    df_eta[qty_per_ss_col] = pd.to_numeric(df_eta[qty_per_ss_col], errors="coerce")
+    df_eta = _prepare_eta(
+        eta_bytes, uploaded_eta.name, stock_col, supplier_col, qty_col, eta_col, qty_per_ss_col
+    )
 
     # ensure valid Qty/SS (>0)
     bad_qpss = df_eta[qty_per_ss_col].isna() | (df_eta[qty_per_ss_col] <= 0)
@@ -88,100 +283,109 @@ if uploaded_eta is not None:
         st.dataframe(df_eta.loc[bad_qpss, [stock_col, qty_col, qty_per_ss_col]].head(10))
         st.stop()
 
-    # parse dates
-    df_eta[eta_col] = pd.to_datetime(df_eta[eta_col], errors="coerce")
+    # Qty/SS is a piece count: require whole numbers so shipset math stays in integers
+    frac_qpss = df_eta[qty_per_ss_col] % 1 != 0
+    if frac_qpss.any():
+        st.error(
+            "Some rows have a non-integer **Qty/SS**. "
+            "Please fix the ETA file and re-upload. Showing first few invalid rows below."
+        )
+        st.dataframe(df_eta.loc[frac_qpss, [stock_col, qty_col, qty_per_ss_col]].head(10))
+        st.stop()
+    df_eta[qty_per_ss_col] = df_eta[qty_per_ss_col].astype(int)
+
     if df_eta[eta_col].isna().any():
         st.warning("Some ETA values could not be parsed as dates and will be left blank in the cell text.")
 
     # ---------- Step 2: Upload LOB ----------
     init_file = st.file_uploader("Upload your LOB table (CSV or Excel)", type=["csv", "xlsx"])
     if init_file is not None:
-        if init_file.name.endswith(".csv"):
-            df_lob = pd.read_csv(init_file, index_col=0)
-        else:
-            df_lob = pd.read_excel(init_file, index_col=0)
+        df_lob = _read_upload(init_file.getvalue(), init_file.name, index_col=0)
 
         # Standardize index (stockcodes) & columns (A/C#)
         df_lob.index = _std_str_series(df_lob.index.to_series())
         df_lob.columns = [str(c).strip() for c in df_lob.columns]
-        ac_columns = df_lob.columns.tolist()
+
+        # Dates become text and NaT becomes NA before the empties pass, so no NaT/Timestamp reaches the export
+        df_lob = _dates_as_text(df_lob).astype(object)
 
         # Normalize empties (preserve 'Stock' strings)
-        df_lob = df_lob.replace({None: pd.NA})
         df_lob = df_lob.fillna("")  # empty cells become ''
+        # Cells the fill may use: NaN/None (now '') and blank or whitespace-only strings; 'Stock' is NOT empty.
+        # One column-wise string compare classifies the whole LOB; the cell values themselves stay as uploaded.
+        lob_empty = df_lob.apply(lambda col: col.astype(str).str.strip().eq("")).to_numpy(dtype=bool)
 
         st.subheader("Initial LOB Table (unchanged)")
         st.dataframe(df_lob, use_container_width=True)
 
         # ---------- STRICT MATCH: Only use stockcodes present in LOB ----------
-        present_stockcodes = set(df_lob.index.tolist())
-        df_eta_valid = df_eta[df_eta[stock_col].isin(present_stockcodes)].copy()
-        ignored = sorted(set(df_eta[stock_col]) - present_stockcodes)
+        # One isin pass over the ETA stockcodes; its complement gives the ignored ones
+        in_lob = df_eta[stock_col].isin(df_lob.index.unique())
+        df_eta_valid = df_eta[in_lob]
+        ignored = sorted(df_eta.loc[~in_lob, stock_col].unique())
         if show_ignored and ignored:
             st.info(
                 f"Ignored {len(ignored)} stockcode(s) not in LOB: "
                 + ", ".join(ignored[:20]) + (" ..." if len(ignored) > 20 else "")
             )
 
-        # Sort by Stockcode then ETA (oldest first)
+        # Sort by Stockcode then ETA (oldest first); this also gives a fresh frame for the helper columns below
         df_eta_valid = df_eta_valid.sort_values([stock_col, eta_col], kind="stable")
 
         # ---------- Fill ETAs into a working copy ----------
-        styled_table = df_lob.copy()
+        # Work on plain object arrays with positional lookups; .loc per cell is far too slow
+        lob_values = df_lob.to_numpy(dtype=object)
+        row_of = {s: i for i, s in enumerate(df_lob.index)}
+
+        # Empty A/C# columns of every stock, listed once for the whole LOB (row-major, sliced by row_start)
+        empty_cols = np.nonzero(lob_empty)[1].astype(np.int64)
+        row_start = np.concatenate([[0], np.cumsum(lob_empty.sum(axis=1))]).astype(np.int64)
+
+        # Integer-factorize stockcodes (-> LOB row) and suppliers; label lookups happen once per unique value
+        stock_ids, stock_uniques = pd.factorize(df_eta_valid[stock_col])
+        eta_row_ids = np.array([row_of[s] for s in stock_uniques], dtype=np.int64)[stock_ids]
+        sup_ids, sup_uniques = pd.factorize(df_eta_valid[supplier_col])
+        sup_bgcolors = np.array([supplier_colors.get(sup, "#FFFFFF") for sup in sup_uniques], dtype=object)
+
+        # Place shipments: the sequential walk runs on plain int arrays (JIT-compiled when numba is available)
+        place_row, place_col, place_src, leftover_pcs = _place_shipsets(
+            empty_cols,
+            row_start,
+            eta_row_ids,
+            df_eta_valid[qty_col].to_numpy(dtype=np.int64),
+            df_eta_valid[qty_per_ss_col].to_numpy(dtype=np.int64),
+        )
+
+        # Format cell text Supplier-MM/DD/YY (and its HTML) once per ETA line
+        df_eta_valid["_bg"] = pd.Series(sup_bgcolors[sup_ids], index=df_eta_valid.index, dtype=str)
+        df_eta_valid["_text"] = df_eta_valid[supplier_col] + "-" + df_eta_valid["_eta_str"]
+        df_eta_valid["_html"] = (
+            '<div style="background-color:' + df_eta_valid["_bg"] + '; padding:4px;">'
+            + df_eta_valid["_text"] + "</div>"
+        )
+        supplier_names = np.asarray(sup_uniques, dtype=object)[sup_ids]
+        cell_texts = df_eta_valid["_text"].to_numpy(dtype=object)
+        cell_htmls = df_eta_valid["_html"].to_numpy(dtype=object)
+
+        # Batch-assign all placements: one fancy-indexed store per output array
+        values = lob_values.copy()
+        values[place_row, place_col] = cell_htmls[place_src]
+        # Plain-text twin of `values` for the Excel export, so no HTML stripping is needed later
+        plain_values = lob_values.copy()
+        plain_values[place_row, place_col] = cell_texts[place_src]
+        # Supplier that filled each cell (None for cells taken from the LOB as-is)
+        sup_values = np.full(lob_values.shape, None, dtype=object)
+        sup_values[place_row, place_col] = supplier_names[place_src]
 
         # Track leftovers per stockcode (partial shipsets)
-        leftovers = {}
-
-        for stock in df_eta_valid[stock_col].unique():
-            rows = df_eta_valid[df_eta_valid[stock_col] == stock]
-
-            # Find first empty A/C# cell once per stock
-            ac_idx = 0
-            while ac_idx < len(ac_columns) and (not _cell_is_empty(styled_table.loc[stock, ac_columns[ac_idx]])):
-                ac_idx += 1
-
-            # Place shipments
-            for _, r in rows.iterrows():
-                qty = int(r[qty_col])
-                qpss = float(r[qty_per_ss_col])
-                if qty <= 0:
-                    continue
-
-                # How many shipsets does this shipment cover?
-                sets = int(qty // qpss)  # floor
-                rem = qty - sets * qpss   # remainder pieces (not enough for a full shipset)
-
-                # Format cell text Supplier-MM/DD/YY
-                if pd.notna(r[eta_col]):
-                    eta_str = r[eta_col].strftime("%m/%d/%y")
-                else:
-                    eta_str = "N/A"
-                supplier_name = r[supplier_col]
-                bgcolor = supplier_colors.get(supplier_name, "#FFFFFF")
-                cell_text = f"{supplier_name}-{eta_str}"
-
-                # Place 'sets' cells across next empty A/C# columns
-                placed = 0
-                while placed < sets and ac_idx < len(ac_columns):
-                    # advance to next empty
-                    while ac_idx < len(ac_columns) and (not _cell_is_empty(styled_table.loc[stock, ac_columns[ac_idx]])):
-                        ac_idx += 1
-                    if ac_idx >= len(ac_columns):
-                        break
-
-                    styled_table.loc[stock, ac_columns[ac_idx]] = (
-                        f'<div style="background-color:{bgcolor}; padding:4px;">{cell_text}</div>'
-                    )
-                    placed += 1
-                    ac_idx += 1
-
-                # Record leftovers if any
-                if rem > 0:
-                    leftovers[stock] = leftovers.get(stock, 0) + rem
+        leftovers = {stock: pcs for stock, pcs in sorted(zip(df_lob.index, leftover_pcs.tolist())) if pcs > 0}
+
+        styled_table = pd.DataFrame(values, index=df_lob.index, columns=df_lob.columns)
+        plain_table = pd.DataFrame(plain_values, index=df_lob.index, columns=df_lob.columns)
 
         # ---------- Show filled table ----------
         st.subheader("Filled ETA Table (Color Coded by Supplier)")
-        st.write(styled_table.to_html(escape=False), unsafe_allow_html=True)
+        st.write(_html_table(styled_table), unsafe_allow_html=True)
 
         # Show leftovers info
         if leftovers:
@@ -195,41 +399,36 @@ if uploaded_eta is not None:
         output = io.BytesIO()
         try:
             writer_engine = "xlsxwriter"
-            import xlsxwriter  # noqa: F401
+            import xlsxwriter
         except ImportError:
             writer_engine = "openpyxl"
             import openpyxl  # noqa: F401
 
-        with pd.ExcelWriter(output, engine=writer_engine) as writer:
-            # Remove HTML for Excel text
-            df_for_xlsx = styled_table.replace(r"<.*?>", "", regex=True)
-            df_for_xlsx.to_excel(writer, index=True, sheet_name="ETA")
-            workbook = writer.book
-            worksheet = writer.sheets["ETA"]
-
-            # Apply background colors if using xlsxwriter
-            if writer_engine == "xlsxwriter":
-                for r_idx, stock in enumerate(styled_table.index, start=1):
-                    for c_idx, col in enumerate(styled_table.columns, start=1):
-                        cell_val = styled_table.loc[stock, col]
-                        if pd.isna(cell_val) or str(cell_val).strip() == "":
-                            continue
-                        text_val = str(cell_val)
-                        fmt_to_use = None
-                        clean_text = text_val
-                        for sup, color in supplier_colors.items():
-                            if sup in text_val:
-                                fmt_to_use = workbook.add_format({"bg_color": color})
-                                clean_text = (
-                                    text_val.replace(f'<div style="background-color:{color}; padding:4px;">', "")
-                                            .replace("</div>", "")
-                                )
-                                break
-                        if fmt_to_use:
-                            worksheet.write(r_idx, c_idx, clean_text, fmt_to_use)
-                        else:
-                            # No mapped color => write plain text (HTML already stripped)
-                            worksheet.write(r_idx, c_idx, clean_text)
+        if writer_engine == "xlsxwriter" and len(plain_table) >= _DIRECT_XML_MIN_ROWS:
+            # Large export: per-cell API calls dominate, so emit the sheet XML directly
+            _write_xlsx_direct(output, plain_table, plain_values, sup_values)
+        elif writer_engine == "xlsxwriter":
+            # Stream rows straight through xlsxwriter; constant_memory flushes each row once it is written
+            workbook = xlsxwriter.Workbook(output, {"constant_memory": True, "strings_to_urls": False})
+            worksheet = workbook.add_worksheet("ETA")
+            # Strings are stored as text, never as formulas ("=...", "{=...}"), matching _write_xlsx_direct
+            worksheet.add_write_handler(str, _write_text)
+            # One Format per supplier color, registered once rather than per cell
+            fmt_cache = {sup: workbook.add_format({"bg_color": color}) for sup, color in supplier_colors.items()}
+
+            worksheet.write_row(0, 0, [plain_table.index.name or "", *plain_table.columns])
+            for r_idx, (stock, texts, sups) in enumerate(zip(plain_table.index, plain_values, sup_values), start=1):
+                worksheet.write(r_idx, 0, stock)
+                worksheet.write_row(r_idx, 1, [_nonfinite_as_text(v) for v in texts])
+                # Re-write only the filled cells whose supplier has a color (same row, so still in memory)
+                for c_idx in np.flatnonzero(np.not_equal(sups, None)):
+                    fmt_to_use = fmt_cache.get(sups[c_idx])
+                    if fmt_to_use is not None:
+                        worksheet.write(r_idx, c_idx + 1, texts[c_idx], fmt_to_use)
+            workbook.close()
+        else:
+            with pd.ExcelWriter(output, engine=writer_engine) as writer:
+                plain_table.to_excel(writer, index=True, sheet_name="ETA")
 
         output.seek(0)
         st.download_button(